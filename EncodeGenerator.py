@@ -1,44 +1,50 @@
-import cv2
 import face_recognition
-import pickle
 import os
 
-# Importing the student images
-folderPath = 'Images'
-pathList = os.listdir(folderPath)
-print(pathList)
-imgList = []
-studentIds = []
+from face_utils import load_rgb, save_known_encodings
 
 # Filter out non-image files (DS Store, etc.)
 valid_extensions = ('.png', '.jpg', '.jpeg')  # Add other extensions if needed
-for path in pathList:
-    if path.endswith(valid_extensions):  # Check if the file is an image
-        imgList.append(cv2.imread(os.path.join(folderPath, path)))
-        studentIds.append(os.path.splitext(path)[0])
-print(studentIds)
 
 
-def findEncodings(imagesList):
-    encodeList = []
-    for img in imagesList:
+def findEncodings(folderPath, pathList):
+    """
+    Yields (studentId, encoding) for each image in pathList, reading one
+    image at a time so decoded images never pile up in memory.
+    """
+    for path in pathList:
+        if not path.endswith(valid_extensions):  # Check if the file is an image
+            continue
+        img = load_rgb(os.path.join(folderPath, path))
         if img is None:
             continue  # Skip invalid images
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        encode = face_recognition.face_encodings(img)[0]
-        encodeList.append(encode)
-    return encodeList
-
-print("Encoding Started...")
-encodeListKnown = findEncodings(imgList)
-encodeListKnownWithIds = [encodeListKnown, studentIds]
-print("Encoding Complete")
-
-file = open("EncodeFile.p", "wb")
-pickle.dump(encodeListKnownWithIds, file)
-file.close()
-print("File Saved")
-
-
-
-
+        encodings = face_recognition.face_encodings(img)
+        del img
+        if not encodings:
+            continue  # Skip images without a face
+        yield os.path.splitext(path)[0], encodings[0]
+
+
+def main():
+    # Importing the student images
+    folderPath = 'Images'
+    pathList = os.listdir(folderPath)
+    print(pathList)
+
+    print("Encoding Started...")
+    encodeListKnown = []
+    studentIds = []
+    for studentId, encode in findEncodings(folderPath, pathList):
+        studentIds.append(studentId)
+        encodeListKnown.append(encode)
+    print(studentIds)
+    print("Encoding Complete")
+
+    # Saves the encodings (plus int8 copies for fast matching) as .npy files
+    # and the IDs as ids.json
+    save_known_encodings(encodeListKnown, studentIds)
+    print("Files Saved")
+
+
+if __name__ == "__main__":
+    main()
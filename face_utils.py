@@ -0,0 +1,458 @@
+import json
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+import cv2
+import dlib
+import face_recognition
+import numpy as np
+from face_recognition.api import face_encoder, pose_predictor_5_point
+
+# Optional: numba compiles the per-photo match check into a fused loop
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
+# Optional: pynvml reports free GPU memory, used to size CNN batches
+try:
+    import pynvml
+except ImportError:
+    pynvml = None
+
+# The CNN detector is far more accurate, but only practical on a GPU
+DETECTION_MODEL = "cnn" if dlib.DLIB_USE_CUDA else "hog"
+
+# Rough GPU memory the CNN detector needs per pixel it runs on. dlib tiles
+# the image pyramid into one float image (about 2x the pixels, 3 channels),
+# and the first convolution layers keep 16-32 float32 channels over that
+# at 1/2 to 1/4 resolution; together with cuDNN workspace this is
+# estimated at up to ~200 bytes per pixel, rounded up for headroom.
+CNN_BYTES_PER_PIXEL = 256
+
+# Smallest face, in pixels, the HOG detector finds at one upsample
+HOG_MIN_FACE_PX = 40
+
+# Encodings for a photo with no faces (or one that could not be read)
+NO_FACES = np.empty((0, 128), dtype=np.float32)
+
+# Files written by save_known_encodings; .npy so they can be memory-mapped
+KNOWN_ENCODING_FILES = {
+    "encodings": "encodings.npy",
+    "quantized": "encodings_q.npy",
+    "scale": "encodings_scale.npy",
+    "sq": "encodings_sq.npy",
+}
+KNOWN_IDS_FILE = "ids.json"
+
+# Bump when encode_batch changes how encodings are computed, so cached
+# encodings from an older version are not reused
+ENCODER_VERSION = "5pt-1"
+
+
+@lru_cache(maxsize=None)
+def dlib_build_warning():
+    """
+    Prints the dlib build flags that matter for speed (once per process).
+    Returns a warning message if dlib was built without AVX and has no CUDA
+    to fall back on, otherwise None.
+    """
+    use_cuda = dlib.DLIB_USE_CUDA
+    use_avx = getattr(dlib, "USE_AVX_INSTRUCTIONS", None)
+    num_gpus = dlib.cuda.get_num_devices() if use_cuda else 0
+    print(f"[INFO] dlib {dlib.__version__}: CUDA={use_cuda} ({num_gpus} devices), AVX={use_avx}")
+
+    if use_cuda or use_avx is not False:
+        return None
+    return (
+        "dlib was built without AVX instructions, so face detection and "
+        "encoding will be much slower than they should be.\n\n"
+        "Rebuild it from source with AVX enabled, e.g.:\n"
+        "   pip install --no-binary dlib --force-reinstall dlib\n\n"
+        "See http://dlib.net/compile.html for details."
+    )
+
+
+def prefetch(func, items, max_workers=4, ahead=8):
+    """
+    Yields (item, func(item)) for each item, in order, while up to `ahead`
+    later calls run on a pool of reader threads. Used to overlap image
+    decoding (cv2 releases the GIL) with face detection on earlier images.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        for item in items:
+            pending.append((item, executor.submit(func, item)))
+            if len(pending) >= ahead:
+                item, future = pending.popleft()
+                yield item, future.result()
+
+        while pending:
+            item, future = pending.popleft()
+            yield item, future.result()
+
+
+def load_rgb(filepath):
+    """
+    Reads an image file as an RGB array, or returns None if it can't be read.
+
+    The BGR -> RGB channel swap is done in place on the decoded buffer, so no
+    second full-size array is allocated.
+    """
+    image = cv2.imread(filepath)
+    if image is None:
+        return None
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB, dst=image)
+
+
+def detection_image(image, dst=None):
+    """
+    Converts a BGR image into the input the face detector wants: RGB for
+    the CNN detector, a single-channel grayscale array for HOG (which
+    ignores color, so it has a third of the bytes to scan).
+
+    If dst is a previous result of the same size it is written into and
+    returned, otherwise a new array is returned.
+    """
+    if DETECTION_MODEL == "cnn":
+        return cv2.cvtColor(image, cv2.COLOR_BGR2RGB, dst=dst)
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=dst)
+
+
+def gpu_batch_size(shape, batch_size, number_of_times_to_upsample=1):
+    """
+    Caps batch_size so a batch of images of the given shape fits in the free
+    memory of the first GPU. Each upsample doubles both sides of the image
+    the CNN runs on, so it is accounted for too. Returns batch_size unchanged
+    if pynvml is not installed or the GPU can't be queried, and warns if not
+    even one image fits (the detector is then likely to run out of memory).
+    """
+    if pynvml is None:
+        return batch_size
+
+    try:
+        pynvml.nvmlInit()
+        try:
+            handle = pynvml.nvmlDeviceGetHandleByIndex(0)
+            free = pynvml.nvmlDeviceGetMemoryInfo(handle).free
+        finally:
+            pynvml.nvmlShutdown()
+    except pynvml.NVMLError:
+        return batch_size
+
+    pixels = shape[0] * shape[1] * 4 ** number_of_times_to_upsample
+    per_image = pixels * CNN_BYTES_PER_PIXEL
+    fits = int(free * 0.8) // per_image
+    if fits == 0:
+        print(
+            f"[WARNING] Face detection on a {shape[1]}x{shape[0]} image needs about "
+            f"{per_image >> 20} MB of GPU memory, but only {free >> 20} MB is free. "
+            "Lower the upsampling or the image size if it runs out of memory."
+        )
+    return max(1, min(batch_size, fits))
+
+
+def detect_batch(images, batch_size=32, number_of_times_to_upsample=1):
+    """
+    Finds the face locations in a list of RGB images (or grayscale ones on
+    the HOG path, see detection_image).
+    Returns one list of (top, right, bottom, left) tuples per image, in order.
+
+    With a CUDA build of dlib, images of the same size are grouped and sent
+    through the CNN detector batch_size at a time (fewer if the GPU is short
+    on memory, see gpu_batch_size). Otherwise each image goes through the HOG
+    detector in turn.
+    """
+    if DETECTION_MODEL == "hog":
+        return [
+            face_recognition.face_locations(img, number_of_times_to_upsample)
+            for img in images
+        ]
+
+    # The CNN batch API needs every frame in a batch to share one shape
+    by_shape = {}
+    for idx, img in enumerate(images):
+        by_shape.setdefault(img.shape, []).append(idx)
+
+    locations = [None] * len(images)
+    for shape, indices in by_shape.items():
+        shape_batch_size = gpu_batch_size(shape, batch_size, number_of_times_to_upsample)
+        for start in range(0, len(indices), shape_batch_size):
+            chunk = indices[start:start + shape_batch_size]
+            batch_locations = face_recognition.batch_face_locations(
+                [images[i] for i in chunk],
+                number_of_times_to_upsample=number_of_times_to_upsample,
+                batch_size=shape_batch_size
+            )
+            for idx, face_locations in zip(chunk, batch_locations):
+                locations[idx] = face_locations
+
+    return locations
+
+
+def detection_scale(shape, max_side=1024, min_face_px=100):
+    """
+    Returns the factor (<= 1.0) to shrink an image of the given shape by
+    before face detection. The image is shrunk to fit max_side, but never so
+    far that a face of min_face_px falls below what the detector can find.
+    """
+    h, w = shape[:2]
+    scale = max(max_side / max(h, w), HOG_MIN_FACE_PX / min_face_px)
+    return min(1.0, scale)
+
+
+def scale_locations(face_locations, scale, shape):
+    """
+    Maps face locations found on an image shrunk by scale back onto the
+    original image of the given shape, clipped to its bounds.
+    """
+    h, w = shape[:2]
+    return [
+        (
+            max(int(round(top / scale)), 0),
+            min(int(round(right / scale)), w),
+            min(int(round(bottom / scale)), h),
+            max(int(round(left / scale)), 0),
+        )
+        for top, right, bottom, left in face_locations
+    ]
+
+
+def encode_batch(images, all_locations):
+    """
+    Computes the face encodings for a list of RGB images, given the face
+    locations found in each. Returns one N x 128 float32 array per image.
+
+    Uses the same 5-point landmark alignment as face_recognition.face_encodings
+    (its default model="small"), so the results are comparable with the
+    reference and known encodings made that way. The face chips from every
+    image go through dlib's ResNet in a single forward pass instead of one
+    pass per face. Images without faces never reach dlib.
+    """
+    encodings = [NO_FACES] * len(images)
+    with_faces = []
+    batch_images = []
+    batch_shapes = []
+    for idx, (img, face_locations) in enumerate(zip(images, all_locations)):
+        if not face_locations:
+            continue
+
+        shapes = dlib.full_object_detections()
+        for top, right, bottom, left in face_locations:
+            shapes.append(pose_predictor_5_point(img, dlib.rectangle(left, top, right, bottom)))
+        with_faces.append(idx)
+        batch_images.append(img)
+        batch_shapes.append(shapes)
+
+    if not with_faces:
+        return encodings
+
+    descriptors = face_encoder.compute_face_descriptor(batch_images, batch_shapes, 0)
+    for idx, d in zip(with_faces, descriptors):
+        encodings[idx] = np.array(d, dtype=np.float32).reshape(-1, 128)
+    return encodings
+
+
+def crop_to_faces(image, face_locations, margin=0.5):
+    """
+    Crops image to the area around face_locations, padded on each side by
+    margin times the face size so the landmark model and face chip have
+    room. Returns the crop and the face locations relative to it.
+    """
+    h, w = image.shape[:2]
+    top = min(max(0, t - int((b - t) * margin)) for t, r, b, l in face_locations)
+    bottom = max(min(h, b + int((b - t) * margin)) for t, r, b, l in face_locations)
+    left = min(max(0, l - int((r - l) * margin)) for t, r, b, l in face_locations)
+    right = max(min(w, r + int((r - l) * margin)) for t, r, b, l in face_locations)
+
+    shifted = [(t - top, r - left, b - top, l - left) for t, r, b, l in face_locations]
+    return image[top:bottom, left:right], shifted
+
+
+if njit is not None:
+    @njit(fastmath=True, cache=True)
+    def _any_match_kernel(E, ref, tol2):
+        for i in range(E.shape[0]):
+            d = 0.0
+            for k in range(E.shape[1]):
+                t = E[i, k] - ref[k]
+                d += t * t
+            if d <= tol2:
+                return True
+        return False
+
+
+def any_face_matches(encodings, ref, ref_sq, tol=0.6):
+    """
+    Returns True if any row of the N x 128 encodings is within tol of ref.
+
+    ref should be float32 and ref_sq its precomputed squared norm (ref @ ref).
+    With numba installed this runs as a compiled loop that stops at the first
+    matching face; otherwise it is a single matrix-vector product and a
+    threshold.
+    """
+    if njit is not None:
+        E = np.ascontiguousarray(encodings, dtype=np.float32)
+        return _any_match_kernel(E, ref, tol * tol)
+
+    E = np.asarray(encodings, dtype=np.float32)
+    d2 = ref_sq - 2 * (E @ ref) + (E * E).sum(1)
+    return bool((d2 <= tol * tol).any())
+
+
+def nearest_known(encodings, known, tol=0.6):
+    """
+    For each row of encodings (N x 128), finds the closest row of known
+    (M x 128). Returns (nearest, matched): the index of the closest known
+    encoding and whether it is within tol, one entry per row of encodings.
+
+    All N x M squared distances come from a single matrix product.
+    """
+    E = np.asarray(encodings, dtype=np.float32).reshape(-1, 128)
+    K = np.asarray(known, dtype=np.float32)
+    dist2 = (E * E).sum(1)[:, None] - 2 * (E @ K.T) + (K * K).sum(1)[None, :]
+    nearest = dist2.argmin(1)
+    return nearest, dist2[np.arange(len(E)), nearest] <= tol * tol
+
+
+def quantize_encodings(encodings):
+    """
+    Quantizes N x 128 encodings to int8 with one scale per row, so that
+    encodings ~= quantized * scale[:, None]. Returns (quantized, scale, sq),
+    where sq is the squared norm of each dequantized row.
+    """
+    E = np.asarray(encodings, dtype=np.float32).reshape(-1, 128)
+    scale = np.abs(E).max(1) / 127
+    scale[scale == 0] = 1.0
+    quantized = np.round(E / scale[:, None]).astype(np.int8)
+    sq = (quantized.astype(np.int32) ** 2).sum(1) * scale ** 2
+    return quantized, scale, sq.astype(np.float32)
+
+
+if njit is not None:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _int8_dot_kernel(Q, K):
+        out = np.empty((Q.shape[0], K.shape[0]), dtype=np.int32)
+        for i in prange(Q.shape[0]):
+            for j in range(K.shape[0]):
+                acc = 0
+                for k in range(Q.shape[1]):
+                    acc += np.int32(Q[i, k]) * np.int32(K[j, k])
+                out[i, j] = acc
+        return out
+
+
+def nearest_known_quantized(encodings, known, known_q, known_scale, known_sq,
+                            tol=0.6, recheck=0.02):
+    """
+    Same as nearest_known, but compares against the int8 encodings from
+    quantize_encodings(known). Faces whose approximate distance is within
+    recheck of tol are re-checked against the float encodings in known.
+
+    NumPy has no int8 matrix product, so without numba this just calls
+    nearest_known on the float encodings.
+    """
+    if njit is None:
+        return nearest_known(encodings, known, tol)
+
+    E = np.asarray(encodings, dtype=np.float32).reshape(-1, 128)
+    Q, qs, q_sq = quantize_encodings(E)
+
+    dot = _int8_dot_kernel(Q, known_q)
+    dist2 = q_sq[:, None] + known_sq[None, :] - 2 * dot * qs[:, None] * known_scale[None, :]
+    nearest = dist2.argmin(1)
+    dist = np.sqrt(np.maximum(dist2[np.arange(len(E)), nearest], 0))
+    matched = dist <= tol
+
+    borderline = np.flatnonzero(np.abs(dist - tol) <= recheck)
+    if len(borderline):
+        K = np.asarray(known[nearest[borderline]], dtype=np.float32)
+        exact2 = ((E[borderline] - K) ** 2).sum(1)
+        matched[borderline] = exact2 <= tol * tol
+
+    return nearest, matched
+
+
+def save_known_encodings(encodings, ids, folder="."):
+    """
+    Saves known face encodings (float32 and int8, see quantize_encodings)
+    as .npy files plus their IDs as JSON.
+    """
+    E = np.asarray(encodings, dtype=np.float32).reshape(-1, 128)
+    quantized, scale, sq = quantize_encodings(E)
+    arrays = {"encodings": E, "quantized": quantized, "scale": scale, "sq": sq}
+    for name, filename in KNOWN_ENCODING_FILES.items():
+        np.save(os.path.join(folder, filename), arrays[name])
+
+    with open(os.path.join(folder, KNOWN_IDS_FILE), "w") as file:
+        json.dump(list(ids), file)
+
+
+def load_known_encodings(folder="."):
+    """
+    Loads what save_known_encodings wrote, with the arrays memory-mapped so
+    they are paged in on demand rather than read up front.
+    Returns (encodings, ids, quantized, scale, sq).
+    """
+    arrays = {
+        name: np.load(os.path.join(folder, filename), mmap_mode="r")
+        for name, filename in KNOWN_ENCODING_FILES.items()
+    }
+    with open(os.path.join(folder, KNOWN_IDS_FILE)) as file:
+        ids = np.asarray(json.load(file))
+
+    return arrays["encodings"], ids, arrays["quantized"], arrays["scale"], arrays["sq"]
+
+
+def encoding_cache_key(entry, *settings):
+    """
+    Key for a photo (an os.DirEntry) in the encoding cache. Includes the
+    file's mtime and size so edited photos are re-encoded, the encoder
+    version, plus any detection settings that change which faces are found.
+    """
+    stat = entry.stat()
+    return (entry.name, stat.st_mtime, stat.st_size, ENCODER_VERSION) + settings
+
+
+def load_encoding_cache(cache_path):
+    """
+    Loads the {key: encodings} dict saved by save_encoding_cache.
+    Returns an empty dict if there is no usable cache file.
+
+    The file lives in whatever folder is being scanned, so it is read
+    without pickle and anything unexpected is treated as no cache.
+    """
+    try:
+        with np.load(cache_path, allow_pickle=False) as data:
+            keys = [tuple(json.loads(key)) for key in data["keys"]]
+            counts = data["counts"].astype(np.int64)
+            encodings = data["encodings"].astype(np.float32)
+
+        if (len(keys) != len(counts) or encodings.ndim != 2
+                or encodings.shape[1] != 128 or counts.sum() != len(encodings)):
+            return {}
+        rows = np.split(encodings, np.cumsum(counts)[:-1]) if len(counts) else []
+        return dict(zip(keys, rows))
+    except Exception:
+        return {}
+
+
+def save_encoding_cache(cache_path, cache):
+    """
+    Saves the {key: encodings} dict as an .npz file: the keys as JSON
+    strings, all encodings stacked into one array, and the number of
+    encodings per key. A cache that can't be written (e.g. a read-only
+    folder) is reported and otherwise ignored.
+    """
+    keys = np.array([json.dumps(list(key)) for key in cache], dtype=str)
+    counts = np.array([len(encodings) for encodings in cache.values()], dtype=np.int64)
+    encodings = np.concatenate(
+        [NO_FACES] + [np.asarray(e, dtype=np.float32).reshape(-1, 128) for e in cache.values()]
+    )
+    try:
+        with open(cache_path, 'wb') as file:
+            np.savez(file, keys=keys, counts=counts, encodings=encodings)
+    except OSError as e:
+        print(f"Could not save encoding cache {cache_path}: {e}")
@@ -1,12 +1,38 @@
+import math
+import multiprocessing
 import os
+import shutil
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 import cv2
 import face_recognition
 import numpy as np
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
-from zipfile import ZipFile
+from zipfile import ZIP_STORED, ZipFile, ZipInfo
 from PIL import Image, ImageTk
 
+from face_utils import (
+    DETECTION_MODEL,
+    NO_FACES,
+    any_face_matches,
+    crop_to_faces,
+    detect_batch,
+    detection_image,
+    detection_scale,
+    dlib_build_warning,
+    encode_batch,
+    encoding_cache_key,
+    load_encoding_cache,
+    load_rgb,
+    prefetch,
+    save_encoding_cache,
+    scale_locations,
+)
+
+# Per-folder cache of face encodings, so re-scanning a folder is instant
+CACHE_FILENAME = "face_cache.npz"
+
 # 1) Import from tkinterdnd2
 try:
     from tkinterdnd2 import DND_FILES, TkinterDnD
@@ -25,11 +51,10 @@ def create_encoding_for_face(face_image_path):
     if not os.path.exists(face_image_path):
         raise ValueError(f"Face image not found: {face_image_path}")
 
-    img = cv2.imread(face_image_path)
-    if img is None:
+    rgb_img = load_rgb(face_image_path)
+    if rgb_img is None:
         raise ValueError(f"Failed to read image file: {face_image_path}")
 
-    rgb_img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
     face_locations = face_recognition.face_locations(rgb_img)
 
     if len(face_locations) == 0:
@@ -42,48 +67,238 @@ def create_encoding_for_face(face_image_path):
     return face_encodings[0]  # return the first encoding
 
 
+# Set in each scan worker by _init_worker: a multiprocessing Event that is
+# set when the scan is cancelled
+_worker_stop = None
+
+
+def _init_worker(stop):
+    """
+    Process pool initializer for find_matched_images.
+    """
+    global _worker_stop
+    _worker_stop = stop
+
+    # One OpenCV thread per worker; the pool already uses every core
+    cv2.setNumThreads(1)
+    cv2.setUseOptimized(True)
+
+
+def _crop_faces_rgb(image, scale, face_locations):
+    """
+    Maps face locations found on a copy of image shrunk by scale back onto
+    the full photo. Returns the RGB area around the faces (a copy, so the
+    full photo can be freed) and the face locations within it.
+    """
+    face_locations = scale_locations(face_locations, scale, image.shape)
+    face_area, face_locations = crop_to_faces(image, face_locations)
+    return cv2.cvtColor(face_area, cv2.COLOR_BGR2RGB), face_locations
+
+
+def _encode_batch(filepaths, batch_size=32, min_face_px=100):
+    """
+    Worker for find_matched_images: detects and encodes the faces in a batch
+    of photos. Returns a list of (filepath, encodings) pairs, where encodings
+    is an N x 128 float32 array (N = 0 for unreadable photos or photos without
+    faces).
+
+    With the CNN (a single worker) photos are read ahead on a few threads
+    (see prefetch); with HOG there is already a worker per core, so each one
+    reads its photos in turn. Detection runs on a downscaled copy of each
+    photo (see detection_scale); encodings are taken from the full-resolution
+    photo, cropped to the faces, with all faces in the batch encoded in one
+    pass (see encode_batch). Only the face crops are kept for the whole
+    batch; with HOG each full photo is dropped as soon as it has been searched.
+    """
+    results = []
+    with_faces = []
+    face_areas = []
+    face_area_locations = []
+
+    def add_faces(filepath, image, scale, face_locations):
+        if not face_locations:
+            # nothing to encode, skip the full-size conversion
+            results.append((filepath, NO_FACES))
+            return
+
+        face_area, face_locations = _crop_faces_rgb(image, scale, face_locations)
+        with_faces.append(filepath)
+        face_areas.append(face_area)
+        face_area_locations.append(face_locations)
+
+    # CNN only: full photos waiting for the batched detector
+    pending = []
+    small_images = []
+    # Scratch buffers, reused for every photo of the same size
+    resized = None
+    gray = None
+    if DETECTION_MODEL == "cnn":
+        images = prefetch(cv2.imread, filepaths)
+    else:
+        images = ((filepath, cv2.imread(filepath)) for filepath in filepaths)
+
+    for filepath, image in images:
+        if _worker_stop is not None and _worker_stop.is_set():
+            return results  # scan cancelled; nobody will read the rest
+
+        if image is None:
+            results.append((filepath, NO_FACES))  # skip unreadable images
+            continue
+
+        scale = detection_scale(image.shape, min_face_px=min_face_px)
+        small = image
+        if scale < 1.0:
+            resized = cv2.resize(
+                image, None, dst=resized, fx=scale, fy=scale, interpolation=cv2.INTER_AREA
+            )
+            small = resized
+
+        if DETECTION_MODEL == "cnn":
+            # The CNN takes the whole batch at once, so each frame needs its
+            # own array and the full photos are kept until it has run
+            pending.append((filepath, image, scale))
+            small_images.append(detection_image(small))
+        else:
+            # HOG goes one photo at a time, so the grayscale buffer can be
+            # reused and the full photo dropped right after
+            gray = detection_image(small, dst=gray)
+            add_faces(filepath, image, scale, detect_batch([gray])[0])
+
+    if small_images:
+        all_locations = detect_batch(small_images, batch_size=batch_size)
+        for (filepath, image, scale), face_locations in zip(pending, all_locations):
+            add_faces(filepath, image, scale, face_locations)
+
+    if with_faces:
+        results.extend(zip(with_faces, encode_batch(face_areas, face_area_locations)))
+
+    return results
+
+
 def find_matched_images(
     source_folder,
     face_encoding,
     progress_callback=None,
-    matched_callback=None
+    matched_callback=None,
+    max_workers=None,
+    batch_size=32,
+    min_face_px=100,
+    stop_event=None
 ):
     """
     Goes through each photo in source_folder, compares to face_encoding.
     Returns a list of full file paths that matched.
 
+    Face encodings are cached in source_folder (see CACHE_FILENAME), so only
+    new or changed photos are encoded. Those are handed out to max_workers
+    processes (defaults to one per CPU core, or a single process that owns
+    the GPU when detecting with the CNN): batch_size at a time for the CNN,
+    so face detection can run batched, and in smaller chunks with HOG if
+    that is what it takes to give every worker a share. Faces smaller than about min_face_px may be
+    missed, in exchange for detecting on downscaled copies of large photos.
+
     progress_callback(i, total): for updating a progress bar
     matched_callback(filepath):   for "real-time" match handling
+    stop_event: a threading.Event; once set, the scan stops early (queued
+    photos are dropped, the cache is left as it was) and returns None
     """
     matched_filepaths = []
     valid_extensions = ('.png', '.jpg', '.jpeg')
 
-    all_files = [f for f in os.listdir(source_folder) if f.lower().endswith(valid_extensions)]
-    total_files = len(all_files)
+    with os.scandir(source_folder) as it:
+        all_entries = [
+            entry for entry in it
+            if entry.is_file() and entry.name.lower().endswith(valid_extensions)
+        ]
+    total_files = len(all_entries)
+    all_paths = [entry.path for entry in all_entries]
+
+    cache_path = os.path.join(source_folder, CACHE_FILENAME)
+    cache = load_encoding_cache(cache_path)
+    keys = {
+        entry.path: encoding_cache_key(entry, min_face_px, DETECTION_MODEL)
+        for entry in all_entries
+    }
+    # Only entries for photos still in the folder are kept
+    fresh_cache = {}
+    done = 0
+
+    ref = np.asarray(face_encoding, dtype=np.float32)
+    ref_sq = ref @ ref
+
+    def stopped():
+        return stop_event is not None and stop_event.is_set()
+
+    def handle_encodings(filepath, encodings):
+        nonlocal done
+        if stopped():
+            return
 
-    for i, filename in enumerate(all_files, start=1):
+        done += 1
         if progress_callback:
-            progress_callback(i, total_files)
-
-        filepath = os.path.join(source_folder, filename)
-        image = cv2.imread(filepath)
-        if image is None:
-            continue  # skip unreadable images
-
-        rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        face_locations = face_recognition.face_locations(rgb_image)
-        face_encodings = face_recognition.face_encodings(rgb_image, face_locations)
+            progress_callback(done, total_files)
 
-        for enc in face_encodings:
-            match = face_recognition.compare_faces([face_encoding], enc, tolerance=0.6)[0]
-            if match:
-                matched_filepaths.append(filepath)
+        fresh_cache[keys[filepath]] = encodings
+        if any_face_matches(encodings, ref, ref_sq):
+            matched_filepaths.append(filepath)
 
-                # Real-time callback
-                if matched_callback:
-                    matched_callback(filepath)
+            # Real-time callback
+            if matched_callback:
+                matched_callback(filepath)
 
-                break  # Stop after first match in this image
+    to_encode = []
+    for filepath in all_paths:
+        encodings = cache.get(keys[filepath])
+        if encodings is None:
+            to_encode.append(filepath)
+        else:
+            handle_encodings(filepath, encodings)
+
+    if max_workers is None:
+        max_workers = 1 if DETECTION_MODEL == "cnn" else os.cpu_count()
+
+    if to_encode:
+        chunk_size = batch_size
+        if DETECTION_MODEL == "hog":
+            # HOG gains nothing from big batches, so make sure every worker
+            # gets photos (and progress arrives in small steps)
+            chunk_size = min(batch_size, math.ceil(len(to_encode) / max_workers))
+        batches = [to_encode[i:i + chunk_size] for i in range(0, len(to_encode), chunk_size)]
+        # Spawn rather than fork: this may be called from a background thread
+        # (the GUI does), and forking a multi-threaded process can deadlock
+        mp_context = multiprocessing.get_context("spawn")
+        worker_stop = mp_context.Event()
+        executor = ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=mp_context,
+            initializer=_init_worker,
+            initargs=(worker_stop,)
+        )
+        try:
+            pending = {
+                executor.submit(_encode_batch, batch, batch_size, min_face_px)
+                for batch in batches
+            }
+
+            # Results stream back in completion order; wake up every so often
+            # to notice a stop request
+            while pending and not stopped():
+                finished, pending = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    for filepath, encodings in future.result():
+                        handle_encodings(filepath, encodings)
+        finally:
+            if stopped():
+                # Drop the queued batches and have the workers abandon the
+                # ones they already have, rather than waiting for them
+                worker_stop.set()
+            executor.shutdown(wait=not stopped(), cancel_futures=True)
+
+    if stopped():
+        return None
+
+    if fresh_cache.keys() != cache.keys():
+        save_encoding_cache(cache_path, fresh_cache)
 
     return matched_filepaths
 
@@ -100,8 +315,14 @@ class FaceFilterApp:
         self.face_image_path = ""
         self.face_img_tk = None
         self.matched_files = []
+        self.batch_size = tk.IntVar(value=32)
+        self.min_face_px = tk.IntVar(value=100)
+        self.build_checked = False
+        # Set when the window is closed, to stop a running scan
+        self.stop_event = threading.Event()
 
         self.create_widgets()
+        self.root.protocol("WM_DELETE_WINDOW", self.close)
 
     def create_widgets(self):
         """
@@ -119,6 +340,7 @@ class FaceFilterApp:
         # RIGHT frame - we’ll let this be our drop zone (white box)
         right_frame = tk.Frame(main_frame, bg="white")
         right_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.drop_frame = right_frame
 
         # ---- Make right_frame a drop target for files/folders ----
         right_frame.drop_target_register(DND_FILES)
@@ -126,35 +348,42 @@ class FaceFilterApp:
 
         # --------------- LEFT FRAME CONTENT ---------------
         # Create buttons with a hand cursor on hover
-        btn_select_folder = tk.Button(
+        self.btn_select_folder = tk.Button(
             left_frame, 
             text="Select Input Folder", 
             command=self.select_input_folder,
             cursor="hand2"  # Change to hand cursor on hover
         )
-        btn_select_folder.pack(pady=5, fill=tk.X)
+        self.btn_select_folder.pack(pady=5, fill=tk.X)
 
         self.label_folder = tk.Label(left_frame, text="No folder selected", fg="gray")
         self.label_folder.pack(pady=5)
 
-        btn_select_face = tk.Button(
+        self.btn_select_face = tk.Button(
             left_frame, 
             text="Select Person's Face Photo", 
             command=self.select_face_image,
             cursor="hand2"  # Change to hand cursor on hover
         )
-        btn_select_face.pack(pady=5, fill=tk.X)
+        self.btn_select_face.pack(pady=5, fill=tk.X)
 
         self.label_face = tk.Label(left_frame, text="No face image selected", fg="gray")
         self.label_face.pack(pady=5)
 
-        btn_process = tk.Button(
+        # Number of photos sent to the face detector at once
+        self.spin_batch_size = self.add_spinbox(left_frame, "Batch size:", self.batch_size, 1, 256)
+        # Smallest face worth finding; larger values allow more downscaling
+        self.spin_min_face_px = self.add_spinbox(
+            left_frame, "Min face size (px):", self.min_face_px, 40, 1000
+        )
+
+        self.btn_process = tk.Button(
             left_frame, 
             text="Process/Filter", 
             command=self.process_images,
             cursor="hand2"  # Change to hand cursor on hover
         )
-        btn_process.pack(pady=10, fill=tk.X)
+        self.btn_process.pack(pady=10, fill=tk.X)
 
         self.progress_bar = ttk.Progressbar(
             left_frame, 
@@ -178,6 +407,24 @@ class FaceFilterApp:
         )
         self.face_preview_label.pack(expand=True)  # center it if bigger space
 
+    def add_spinbox(self, parent, text, variable, from_, to):
+        """
+        Add a labelled numeric setting to the given frame.
+        Returns the Spinbox.
+        """
+        frame = tk.Frame(parent)
+        frame.pack(pady=5, fill=tk.X)
+        tk.Label(frame, text=text).pack(side=tk.LEFT)
+        spinbox = tk.Spinbox(
+            frame,
+            from_=from_,
+            to=to,
+            width=5,
+            textvariable=variable
+        )
+        spinbox.pack(side=tk.RIGHT)
+        return spinbox
+
     def drop_folder(self, event):
         """
         Handle the folder that gets dropped onto the white box.
@@ -251,6 +498,13 @@ class FaceFilterApp:
             messagebox.showwarning("Warning", "Please select a face photo first.")
             return
 
+        # Warn (once) if dlib was built in a way that makes scanning slow
+        if not self.build_checked:
+            self.build_checked = True
+            warning = dlib_build_warning()
+            if warning:
+                messagebox.showwarning("Slow dlib build", warning)
+
         # Show & reset progress bar
         self.progress_bar['value'] = 0
         self.progress_bar.pack()
@@ -270,20 +524,70 @@ class FaceFilterApp:
         # Prepare to store matched files
         self.matched_files = []
 
+        try:
+            batch_size = max(1, self.batch_size.get())
+        except tk.TclError:
+            batch_size = 32  # fall back to the default on non-numeric input
+        try:
+            min_face_px = max(40, self.min_face_px.get())
+        except tk.TclError:
+            min_face_px = 100
+
+        # Tk is single-threaded: the worker only posts updates back to the
+        # main loop (see post_to_ui), which runs them on the Tk thread
         def matched_callback(filepath):
-            self.matched_files.append(filepath)
-            self.show_matched_image(filepath)
-
-        # Run the matching
-        find_matched_images(
-            self.source_folder,
-            face_encoding,
-            progress_callback=self.update_progress,
-            matched_callback=matched_callback
-        )
+            self.post_to_ui(self.add_matched_file, filepath)
+
+        def progress_callback(current, total):
+            self.post_to_ui(self.update_progress, current, total)
+
+        def worker():
+            try:
+                find_matched_images(
+                    self.source_folder,
+                    face_encoding,
+                    progress_callback=progress_callback,
+                    matched_callback=matched_callback,
+                    batch_size=batch_size,
+                    min_face_px=min_face_px,
+                    stop_event=self.stop_event
+                )
+            except Exception as e:
+                self.post_to_ui(self.finish_processing, e)
+            else:
+                self.post_to_ui(self.finish_processing, None)
+
+        # Run the matching in the background so the window stays responsive
+        self.set_controls_state(tk.DISABLED)
+        threading.Thread(target=worker, daemon=True).start()
 
+    def post_to_ui(self, func, *args):
+        """
+        Schedule func(*args) on the Tk thread; called from the scan thread.
+        Does nothing once the window is closing.
+        """
+        if not self.stop_event.is_set():
+            self.root.after(0, func, *args)
+
+    def close(self):
+        """
+        Window close handler: stops any running scan, then closes the window.
+        """
+        self.stop_event.set()
+        self.root.destroy()
+
+    def finish_processing(self, error):
+        """
+        Called on the Tk thread once the background matching is done.
+        """
+        self.set_controls_state(tk.NORMAL)
         self.progress_bar.pack_forget()
 
+        if error is not None:
+            self.face_preview_label.config(text="Scan failed")
+            messagebox.showerror("Error", f"Could not scan the folder:\n{error}")
+            return
+
         # Show results
         total_matches = len(self.matched_files)
         if total_matches == 0:
@@ -307,24 +611,48 @@ class FaceFilterApp:
         if not zip_path:
             return  # user canceled
 
-        # Create the ZIP
+        # Create the ZIP. Photos are already compressed, so store them as-is
         try:
-            with ZipFile(zip_path, 'w') as zipf:
+            with ZipFile(zip_path, 'w', compression=ZIP_STORED, allowZip64=True) as zipf:
                 for filepath in self.matched_files:
                     filename = os.path.basename(filepath)
-                    zipf.write(filepath, arcname=filename)
+                    zinfo = ZipInfo.from_file(filepath, arcname=filename)
+                    with open(filepath, 'rb') as src, zipf.open(zinfo, 'w') as dst:
+                        shutil.copyfileobj(src, dst, length=1 << 20)
 
             messagebox.showinfo("Done", f"Matched images saved to:\n{zip_path}")
         except Exception as ex:
             messagebox.showerror("Error", f"Could not create ZIP file:\n{ex}")
 
+    def set_controls_state(self, state):
+        """
+        Enable or disable everything that could change the folder or settings
+        while a scan is running, including the drag & drop target.
+        """
+        for widget in (
+            self.btn_select_folder,
+            self.btn_select_face,
+            self.btn_process,
+            self.spin_batch_size,
+            self.spin_min_face_px,
+        ):
+            widget.config(state=state)
+
+        if state == tk.DISABLED:
+            self.drop_frame.drop_target_unregister()
+        else:
+            self.drop_frame.drop_target_register(DND_FILES)
+
+    def add_matched_file(self, filepath):
+        self.matched_files.append(filepath)
+        self.show_matched_image(filepath)
+
     def update_progress(self, current, total):
         if total <= 0:
             self.progress_bar['value'] = 0
         else:
             percent = (current / total) * 100
             self.progress_bar['value'] = percent
-        self.progress_bar.update()
 
     def show_matched_image(self, filepath):
         """
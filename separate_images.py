@@ -1,65 +1,182 @@
 import os
 import cv2
-import face_recognition
 import pickle
 import numpy as np
 import shutil
 
-# ============ STEP 1: LOAD ENCODINGS ============
-with open('EncodeFile.p', 'rb') as file:
-    encodeListKnown, studentIds = pickle.load(file)
+from EncodeGenerator import findEncodings
+from face_utils import (
+    DETECTION_MODEL,
+    KNOWN_IDS_FILE,
+    crop_to_faces,
+    detect_batch,
+    encode_batch,
+    load_known_encodings,
+    load_rgb,
+    nearest_known_quantized,
+    prefetch,
+    quantize_encodings,
+)
 
-# ============ STEP 2: DEFINE PARAMETERS ============
+# ============ PARAMETERS ============
 # Folder containing the images you want to scan
 source_folder = '/Users/user/Desktop/input'
 
 # Destination folder to hold images that contain the target person's face
 destination_folder = '/Users/user/Desktop/output'
-if not os.path.exists(destination_folder):
-    os.makedirs(destination_folder)
 
 # The specific person's ID/name you want to detect
 target_person_id = 'me'  # Replace with the actual ID or name in studentIds
 
-# ============ STEP 3: SCAN THROUGH ALL IMAGES IN THE FOLDER ============
+# Number of images sent to the face detector at once
+batch_size = 32
+
+# Set to a folder of known faces (as used by EncodeGenerator.py) to encode it
+# in the same run instead of loading the saved encodings
+training_folder = None
+
 valid_extensions = ('.png', '.jpg', '.jpeg')
-for filename in os.listdir(source_folder):
+
+
+def prepare_known(encodeListKnown, studentIds, quantized=()):
+    """
+    Bundles the known encodings and IDs with their int8 copies for matching.
+    """
+    known_encodings = np.asarray(encodeListKnown, dtype=np.float32)
+    # Files saved before int8 quantization was added only hold the float encodings
+    known_q, known_scale, known_sq = quantized or quantize_encodings(known_encodings)
+    return known_encodings, np.asarray(studentIds), known_q, known_scale, known_sq
+
+
+def load_known(folder='.'):
+    """
+    Loads the known encodings saved by EncodeGenerator.py (memory-mapped).
+    Falls back to the EncodeFile.p pickle written by older versions.
+    """
+    if os.path.exists(os.path.join(folder, KNOWN_IDS_FILE)):
+        return load_known_encodings(folder)
+
+    with open(os.path.join(folder, 'EncodeFile.p'), 'rb') as file:
+        encodeListKnown, studentIds, *quantized = pickle.load(file)
+    return prepare_known(encodeListKnown, studentIds, quantized)
+
+
+def scan_folder(source_folder, known, target_person_id, batch_size=32):
+    """
+    Yields the names of the images in source_folder that contain the target
+    person, as each batch of images is processed.
+    """
+    known_encodings, known_ids, known_q, known_scale, known_sq = known
+
     # Only process valid image files
-    if filename.lower().endswith(valid_extensions):
-        filepath = os.path.join(source_folder, filename)
+    with os.scandir(source_folder) as it:
+        all_files = [
+            entry.name for entry in it
+            if entry.is_file() and entry.name.lower().endswith(valid_extensions)
+        ]
+
+    def read_rgb(filename):
+        # Read the image as RGB, since face_recognition uses RGB
+        # (None if the image is not valid)
+        return load_rgb(os.path.join(source_folder, filename))
+
+    def process_batch(filenames, rgb_images, all_locations):
+        if DETECTION_MODEL == "cnn":
+            # Find face locations for the whole batch at once
+            all_locations = detect_batch(rgb_images, batch_size=batch_size)
+            if not any(all_locations):
+                return []  # No faces anywhere in the batch, nothing to encode
+
+        # Encode every face in the batch in one pass, and collect them so they
+        # can be compared in one go
+        enc_buf = []
+        enc_owner = []
+        all_encodings = encode_batch(rgb_images, all_locations)
+        for filename, face_encodings in zip(filenames, all_encodings):
+            enc_buf.extend(face_encodings)
+            enc_owner.extend([filename] * len(face_encodings))
+
+        if not enc_buf:
+            return []
 
-        # Read the image
-        image = cv2.imread(filepath)
-        if image is None:
+        # Find the closest known face for every face in the batch, and keep the
+        # ones where that face is a match and belongs to the target person
+        match_index, matches = nearest_known_quantized(
+            enc_buf, known_encodings, known_q, known_scale, known_sq, tol=0.6
+        )
+        found_target = matches & (known_ids[match_index] == target_person_id)
+        target_files = {enc_owner[i] for i in np.flatnonzero(found_target)}
+        return [filename for filename in filenames if filename in target_files]
+
+    # Images are read ahead on background threads while the current batch is
+    # being detected and compared
+    filenames = []
+    rgb_images = []
+    all_locations = []
+    for filename, rgb_image in prefetch(read_rgb, all_files):
+        if rgb_image is None:
             continue  # Skip if the image is not valid
 
-        # Convert image to RGB (face_recognition uses RGB)
-        rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-
-        # Find face locations and encodings in the image
-        face_locations = face_recognition.face_locations(rgb_image)
-        face_encodings = face_recognition.face_encodings(rgb_image, face_locations)
-
-        # ============ STEP 4: COMPARE EACH FACE ENCODING ============
-        found_target = False
-        for face_encoding in face_encodings:
-            # Compare this face with your known encodings
-            matches = face_recognition.compare_faces(encodeListKnown, face_encoding, tolerance=0.6)
-            face_distances = face_recognition.face_distance(encodeListKnown, face_encoding)
-            match_index = np.argmin(face_distances)
-
-            # If a match is found, check if it's the target person
-            if matches[match_index]:
-                # Check if the matched ID is the target person's ID
-                if studentIds[match_index] == target_person_id:
-                    found_target = True
-                    break  # No need to check more faces if we already found the target
-
-        # If found_target is True, copy or move the file to the destination folder
-        if found_target:
-            src_path = os.path.join(source_folder, filename)
-            dst_path = os.path.join(destination_folder, filename)
-
-            # Copy the file (use shutil.move() if you want to move instead)
-            shutil.copy2(src_path, dst_path) # use move instead of copy2 if you want to move the file instead of copying it
-            print(f"[INFO] Copied '{filename}' because it contains '{target_person_id}'.")
+        if DETECTION_MODEL == "hog":
+            # HOG goes one image at a time, so the faces can be found right
+            # away and only the area around them kept for the batch
+            face_locations = detect_batch([rgb_image])[0]
+            if not face_locations:
+                continue  # No faces, nothing to encode
+            face_area, face_locations = crop_to_faces(rgb_image, face_locations)
+            rgb_image = face_area.copy()  # a copy, so the full image can be freed
+            all_locations.append(face_locations)
+
+        filenames.append(filename)
+        rgb_images.append(rgb_image)
+        if len(filenames) == batch_size:
+            yield from process_batch(filenames, rgb_images, all_locations)
+            filenames = []
+            rgb_images = []
+            all_locations = []
+
+    if filenames:
+        yield from process_batch(filenames, rgb_images, all_locations)
+
+
+def build_and_match(training_dir, scan_dir, target_id, batch_size=32):
+    """
+    Encodes the known faces in training_dir and scans scan_dir for target_id
+    in a single run, without writing EncodeFile.p in between. Yields the
+    names of the matching images in scan_dir.
+    """
+    encodeListKnown = []
+    studentIds = []
+    for studentId, encode in findEncodings(training_dir, os.listdir(training_dir)):
+        studentIds.append(studentId)
+        encodeListKnown.append(encode)
+
+    known = prepare_known(encodeListKnown, studentIds)
+    yield from scan_folder(scan_dir, known, target_id, batch_size)
+
+
+def main():
+    if not os.path.exists(destination_folder):
+        os.makedirs(destination_folder)
+
+    # Keep OpenCV single-threaded; the reader threads provide the parallelism
+    cv2.setNumThreads(1)
+
+    # ============ STEP 1: LOAD (OR BUILD) ENCODINGS AND SCAN THE FOLDER ============
+    if training_folder:
+        matches = build_and_match(training_folder, source_folder, target_person_id, batch_size)
+    else:
+        matches = scan_folder(source_folder, load_known(), target_person_id, batch_size)
+
+    # ============ STEP 2: COPY THE IMAGES CONTAINING THE TARGET ============
+    for filename in matches:
+        src_path = os.path.join(source_folder, filename)
+        dst_path = os.path.join(destination_folder, filename)
+
+        # Copy the file (use shutil.move() if you want to move instead)
+        shutil.copy2(src_path, dst_path) # use move instead of copy2 if you want to move the file instead of copying it
+        print(f"[INFO] Copied '{filename}' because it contains '{target_person_id}'.")
+
+
+if __name__ == "__main__":
+    main()